@@ -1,6 +1,8 @@
+import asyncio
 import os
 import logging
 import httpx
+import orjson
 from dotenv import load_dotenv
 
 # --- Basic Setup ---
@@ -11,15 +13,38 @@ logger = logging.getLogger(__name__)
 PLACES_API_KEY = os.getenv("PLACES_API_KEY")
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
 
+# --- Shared HTTP Client ---
+# A single AsyncClient keeps connections alive between calls, so webhook and
+# geocoding requests skip the TCP+TLS handshake after the first one.
+_client = None
 
-def get_system_prompt(state, current_dubai_date, current_dubai_time):
-    return f"""You are Tala, an AI assistant based in the UAE. Your primary goal is assisting users with booking rides and location suggestions in the UAE.
+
+async def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Assembled once at import; get_system_prompt only fills in the per-session
+# fields instead of rebuilding the whole prompt string on every connection.
+_SYSTEM_PROMPT_TEMPLATE = """You are Tala, an AI assistant based in the UAE. Your primary goal is assisting users with booking rides and location suggestions in the UAE.
 Always respond in English.
 
-User Name: {state.get("user_name", "Unknown")}
-Current User location: {state.get("address", "Unknown")}
-Current UAE Date: {current_dubai_date} , DD-MM-YYYY format
-Current UAE Time: {current_dubai_time} , H:MM AM/PM format
+User Name: {user_name}
+Current User location: {address}
+Current UAE Date: {date} , DD-MM-YYYY format
+Current UAE Time: {time} , H:MM AM/PM format
 
 
 **THE GOLDEN RULES - NON-NEGOTIABLE**
@@ -58,6 +83,15 @@ Your task is to collect these four pieces of information one by one in a natural
 * **TRIGGER:** You can ONLY call the `book_ride` function AFTER you have presented the fare from `get_fare_details` and the user has given a clear, affirmative confirmation (e.g., "Yes," "Book it," "Confirm").
 """
 
+
+def get_system_prompt(state, current_dubai_date, current_dubai_time):
+    return _SYSTEM_PROMPT_TEMPLATE.format(
+        user_name=state.user_name,
+        address=state.address,
+        date=current_dubai_date,
+        time=current_dubai_time,
+    )
+
 # --- Tool Definitions ---
 
 get_fare_details = {
@@ -90,6 +124,80 @@ book_ride = {
 }
 
 
+# --- n8n Micro-Batching ---
+# Opt-in: the n8n workflow must accept {"batch": [...payloads]} and reply
+# with {"results": [...]} in the same order before enabling this.
+N8N_BATCH_ENABLED = os.getenv("N8N_BATCH_ENABLED", "").lower() in ("1", "true", "yes")
+N8N_BATCH_WINDOW = float(os.getenv("N8N_BATCH_WINDOW", "0.02"))
+N8N_MAX_BATCH = int(os.getenv("N8N_MAX_BATCH", "16"))
+
+
+class N8NBatcher:
+    """Coalesces webhook calls issued within a short window into one POST."""
+
+    def __init__(self, window=N8N_BATCH_WINDOW, max_batch=N8N_MAX_BATCH):
+        self._window = window
+        self._max_batch = max_batch
+        self._pending = []
+        self._flush_task = None
+        # Strong references to in-flight POST tasks; a bare create_task
+        # result can be garbage-collected mid-flight.
+        self._post_tasks = set()
+
+    async def submit(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._window)
+        self._flush()
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        task, self._flush_task = self._flush_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        if pending:
+            post_task = asyncio.create_task(self._post_batch(pending))
+            self._post_tasks.add(post_task)
+            post_task.add_done_callback(self._post_tasks.discard)
+
+    async def _post_batch(self, pending):
+        # Every pending future must be resolved no matter what: an escaped
+        # exception here (e.g. a non-2xx reply raising HTTPStatusError past
+        # call_n8n_webhook's RequestError catch, or a non-JSON body) would
+        # otherwise leave every batched caller awaiting forever.
+        try:
+            response = await call_n8n_webhook({"batch": [payload for payload, _ in pending]})
+        except Exception as e:
+            logger.error(f"Error posting n8n batch: {e}")
+            response = {"error": f"Failed to connect to webhook service: {e}"}
+        results = response.get("results") if isinstance(response, dict) else None
+        for i, (_, future) in enumerate(pending):
+            if future.done():
+                continue
+            if results is not None and i < len(results):
+                future.set_result(results[i])
+            else:
+                # Error envelope or malformed batch reply; give it to everyone.
+                future.set_result(response)
+
+
+n8n_batcher = N8NBatcher()
+
+
+async def submit_n8n_payload(payload):
+    """Sends a payload to n8n, batched with concurrent calls when enabled."""
+    if N8N_BATCH_ENABLED:
+        return await n8n_batcher.submit(payload)
+    return await call_n8n_webhook(payload)
+
+
 # --- Utility Functions ---
 
 async def call_n8n_webhook(data):
@@ -99,10 +207,10 @@ async def call_n8n_webhook(data):
         
     headers = {"Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(N8N_WEBHOOK_URL, json=data, headers=headers)
-            response.raise_for_status()
-            return response.json()
+        client = await get_client()
+        response = await client.post(N8N_WEBHOOK_URL, json=data, headers=headers)
+        response.raise_for_status()
+        return response.json()
     except httpx.RequestError as e:
         logger.error(f"Error calling n8n webhook: {e}")
         return {"error": f"Failed to connect to webhook service: {e}"}
@@ -120,18 +228,16 @@ async def reverse_geocode(lat, lon):
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data["status"] == "OK" and data["results"]:
-                    return data["results"][0]["formatted_address"]
-                else:
-                    logger.warning(f"Google returned no results for geocoding: {data}")
-                    return "Unknown location"
-            else:
-                logger.warning(f"Geocoding failed with HTTP {response.status_code}")
-                return "Unknown location"
-    except httpx.RequestError as e:
+        client = await get_client()
+        response = await client.get(url, params=params, timeout=5.0)
+        response.raise_for_status()
+        # orjson on the raw body skips httpx's text-decoding layer.
+        data = orjson.loads(response.content)
+        results = data.get("results")
+        if data.get("status") == "OK" and results:
+            return results[0]["formatted_address"]
+        logger.warning(f"Google returned no results for geocoding: {data}")
+        return "Unknown location"
+    except httpx.HTTPError as e:
         logger.error(f"Error during reverse geocoding request: {e}")
         return "Unknown location (request failed)"
@@ -1,23 +1,27 @@
 import asyncio
 import websockets
-import json
+import orjson
 from dotenv import load_dotenv
 import os
+import re
+from dataclasses import dataclass, fields
 from datetime import datetime
 from google import genai
 from google.genai import types
-import uuid
+import secrets
+import time
 import logging
 import base64
-import pytz
+import binascii
+from zoneinfo import ZoneInfo
 from config import (
     get_system_prompt,
     get_fare_details,
     book_ride,
-    call_n8n_webhook,
-    reverse_geocode
+    submit_n8n_payload,
+    reverse_geocode,
+    close_client
 )
-import wave
 
 # --- Basic Setup ---
 logging.basicConfig(level=logging.INFO)
@@ -33,199 +37,494 @@ if not API_KEY:
 client = genai.Client(api_key=API_KEY)
 model_id = "gemini-live-2.5-flash-preview"
 
+# The confirm frame carries no per-session fields; encode it once. JSON
+# frames are sent as str so they stay WebSocket Text frames — websockets
+# transmits bytes as Binary, which would break JSON.parse(event.data) on
+# the deployed frontend. Only the opt-in audio path sends Binary.
+CONFIRM_FRAME = orjson.dumps({"type": "confirm"}).decode()
+
+# Cap on concurrent sessions: each one holds a Gemini live connection and two
+# tasks, so past this point new connections are rejected fast instead of
+# degrading latency for everyone already connected.
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "200"))
+SESSION_SEM = asyncio.Semaphore(MAX_SESSIONS)
+
+DUBAI_TZ = ZoneInfo("Asia/Dubai")
+
+# Cheap format validation for tool-call args; strptime re-parses its format
+# string (and takes a lock) on every call, which is wasteful on the hot path.
+DATE_RE = re.compile(r"^(0[1-9]|[12]\d|3[01])-(0[1-9]|1[012])-\d{4}$")
+TIME_RE = re.compile(r"^(0?[1-9]|1[0-2]):[0-5]\d\s?(AM|PM)$", re.IGNORECASE)
+
+# Coalesce tiny Gemini audio chunks into fewer WebSocket frames: flush once
+# the buffer reaches this size or the deadline fires, whichever comes first.
+AUDIO_FLUSH_BYTES = 4096
+AUDIO_FLUSH_INTERVAL = 0.04  # seconds; ~40ms of audio is imperceptible
+
+# Same idea for transcription deltas: single-character chunks each cost a
+# frame, so batch them up to a short bounded delay.
+TRANSCRIPT_FLUSH_CHARS = 16
+TRANSCRIPT_FLUSH_INTERVAL = 0.02
+
+# Connection-independent pieces of the Live API config; only the
+# system_instruction varies per session, so build the rest once.
+TOOLS = types.Tool(function_declarations=[get_fare_details, book_ride])
+
+BASE_LIVE_CONFIG = {
+    "response_modalities": ["AUDIO"],
+    "speech_config": {
+        "voice_config": {"prebuilt_voice_config": {"voice_name": "Kore"}}
+    },
+    "realtime_input_config": {
+        "automatic_activity_detection": {
+            "disabled": False, # default
+            "start_of_speech_sensitivity": types.StartSensitivity.START_SENSITIVITY_HIGH,
+            "end_of_speech_sensitivity": types.EndSensitivity.END_SENSITIVITY_HIGH,
+            "prefix_padding_ms": 100,
+            "silence_duration_ms": 100,
+        }
+    },
+    "tools": [TOOLS],
+    "input_audio_transcription": {},
+    "output_audio_transcription": {},
+}
+
+
+@dataclass(slots=True)
+class SessionState:
+    """Per-connection conversation state shared with the n8n webhook."""
+    startLocation: str | None = None
+    endLocation: str | None = None
+    startDate: str | None = None
+    startTime: str | None = None
+    rideConfirmation: bool = False
+    authorization_token: str | None = None
+    user_name: str = "Unknown"
+    latitude: str | float = "Unknown"
+    longitude: str | float = "Unknown"
+    address: str = "Unknown"
+    fare: str | None = None
+
+    def update(self, values):
+        """Applies known fields from a dict, rejecting unknown keys."""
+        for key, value in values.items():
+            if key in _SESSION_FIELDS:
+                setattr(self, key, value)
+            else:
+                logger.warning(f"Ignoring unknown session state field: {key}")
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in _SESSION_FIELDS}
+
+
+_SESSION_FIELDS = tuple(f.name for f in fields(SessionState))
+
+
+# FunctionResponse fields are known-good at these call sites (id/name echo
+# Gemini's own values), so pydantic's validating constructor is skipped.
+_function_response = types.FunctionResponse.model_construct
+
+
+def _decode_audio(audio_b64):
+    """Decodes a base64 audio payload into raw PCM bytes."""
+    # a2b_base64 is the C routine b64decode wraps, minus the str->bytes
+    # preamble and validation overhead.
+    return binascii.a2b_base64(audio_b64)
+
 
 async def handle_websocket(websocket):
-    dubai_tz = pytz.timezone("Asia/Dubai")
-    now_in_dubai = datetime.now(dubai_tz)
-    current_dubai_time = now_in_dubai.strftime("%I:%M %p")
-    current_dubai_date = now_in_dubai.strftime("%d-%m-%Y")
+    if SESSION_SEM.locked():
+        logger.warning(f"Session limit ({MAX_SESSIONS}) reached; rejecting connection.")
+        await websocket.send(orjson.dumps({"error": "Server at capacity. Please try again shortly."}).decode())
+        await websocket.close(code=1013)  # Try Again Later
+        return
+    await SESSION_SEM.acquire()
+
+    # One strftime pass yields both strings; the format-string parse and
+    # tm struct conversion are paid once instead of twice.
+    current_dubai_time, current_dubai_date = datetime.now(DUBAI_TZ).strftime("%I:%M %p|%d-%m-%Y").split("|")
     logger.info(f"Current Dubai time: {current_dubai_time}, date: {current_dubai_date}")
 
-    session_id = f"{int(asyncio.get_event_loop().time())}-{uuid.uuid4().hex[:8]}"
+    session_id = f"{time.monotonic_ns()}-{secrets.token_hex(4)}"
     
     # Initialize session state
-    state = {
-        "startLocation": None,
-        "endLocation": None,
-        "startDate": None,
-        "startTime": None,
-        "rideConfirmation": False,
-        "authorization_token": None,
-    }
-    
-    tools = types.Tool(function_declarations=[get_fare_details, book_ride])
+    state = SessionState()
+
+
     logger.info(f"New client connection established with session ID: {session_id}")
 
+    # Static error envelopes only vary by session_id; encode them once.
+    ERR_AUTH_REQUIRED = orjson.dumps({"error": "Authentication required as first message.", "session_id": session_id}).decode()
+
+    # Everything in the audio frame except the payload is constant for the
+    # session, so emitting a frame is a splice instead of a dict+JSON pass.
+    # [:-2] strips the closing '"}' after the empty audio_chunk value.
+    AUDIO_FRAME_PREFIX = orjson.dumps({"type": "audio_chunk", "session_id": session_id, "audio_chunk": ""})[:-2].decode()
+    FINAL_FRAME = orjson.dumps({"type": "final", "session_id": session_id}).decode()
+
     try:
         # --- Authentication Step ---
         auth_message = await websocket.recv()
-        auth_data = json.loads(auth_message)
+        auth_data = orjson.loads(auth_message)
+
+        # Opt-in: clients that set binary_audio receive audio as raw binary
+        # frames (0x01 tag + PCM) instead of base64 wrapped in JSON, saving
+        # the ~33% base64 inflation and the encode pass per frame.
+        binary_audio = bool(auth_data.get("binary_audio"))
 
         if auth_data.get("type") == "auth" and auth_data.get("token"):
-            state["authorization_token"] = auth_data["token"]
-            state["user_name"] = auth_data.get("name", "Unknown")
-            state["latitude"] = auth_data.get("latitude", "Unknown")
-            state["longitude"] = auth_data.get("longitude", "Unknown")
-            
-            if state["latitude"] != "Unknown" and state["longitude"] != "Unknown":
-                # state["address"] = await reverse_geocode(state["latitude"], state["longitude"])
-                state["address"] = "Dubai Marina" # Using a placeholder as in the original code
+            state.authorization_token = auth_data["token"]
+            state.user_name = auth_data.get("name", "Unknown")
+            state.latitude = auth_data.get("latitude", "Unknown")
+            state.longitude = auth_data.get("longitude", "Unknown")
+
+            # Start geocoding immediately so it overlaps with the auth ack;
+            # the result is only needed when the system prompt is built.
+            geo_task = None
+            if state.latitude != "Unknown" and state.longitude != "Unknown":
+                geo_task = asyncio.create_task(reverse_geocode(state.latitude, state.longitude))
             else:
-                state["address"] = "Unknown location"
-                
-            logger.info(f"Authentication successful for user: {state['user_name']}")
-            await websocket.send(json.dumps({"type": "auth_status", "status": "success", "session_id": session_id}))
+                state.address = "Unknown location"
+
+            logger.info(f"Authentication successful for user: {state.user_name}")
+            await websocket.send(orjson.dumps({"type": "auth_status", "status": "success", "session_id": session_id}).decode())
+
+            if geo_task is not None:
+                try:
+                    # Never let a slow Maps response hold up session start.
+                    state.address = await asyncio.wait_for(geo_task, timeout=2.0)
+                except asyncio.TimeoutError:
+                    logger.warning("Reverse geocoding timed out; using fallback address.")
+                    state.address = "Dubai"
         else:
             logger.warning("First message was not a valid authentication message. Closing connection.")
-            await websocket.send(json.dumps({"error": "Authentication required as first message.", "session_id": session_id}))
+            await websocket.send(ERR_AUTH_REQUIRED)
             await websocket.close()
             return
 
+        # Static parts of every n8n payload; the token never changes after auth.
+        n8n_base = {"session_id": session_id, "headers": {"authorization": state.authorization_token or ""}}
+
         # --- Gemini Configuration ---
         system_prompt_text = get_system_prompt(state, current_dubai_date, current_dubai_time)
         
         config = {
-            "response_modalities": ["AUDIO"],
-            "speech_config": {
-                "voice_config": {"prebuilt_voice_config": {"voice_name": "Kore"}}
-            },
-            "realtime_input_config": {
-                "automatic_activity_detection": {
-                    "disabled": False, # default
-                    "start_of_speech_sensitivity": types.StartSensitivity.START_SENSITIVITY_HIGH,
-                    "end_of_speech_sensitivity": types.EndSensitivity.END_SENSITIVITY_HIGH,
-                    "prefix_padding_ms": 100,
-                    "silence_duration_ms": 100,
-                }
-            },
-            "tools": [tools],
-            "input_audio_transcription": {},
-            "output_audio_transcription": {},
+            **BASE_LIVE_CONFIG,
             "system_instruction": types.Content(parts=[types.Part(text=system_prompt_text)]),
         }
 
 
         # --- Main Communication Loop ---
         async with client.aio.live.connect(model=model_id, config=config) as session:
-            
+
+            # Outbound frames go through a queue so the Gemini receive loop
+            # never blocks on a slow client; a None sentinel stops the writer.
+            out_queue = asyncio.Queue()
+
+            # Backpressure policy: a client that stops draining must not make
+            # the queue grow without bound, so audio stops being enqueued past
+            # this many in-flight frames (~2.5s of playback). Control and
+            # transcript frames are rare and small; they are never dropped.
+            MAX_QUEUED_AUDIO = 64
+            queued_audio = 0
+            dropped_audio = 0
+
+            def is_audio_frame(frame):
+                # Binary frames on egress are always audio; JSON audio frames
+                # share the per-session prefix.
+                if isinstance(frame, bytes):
+                    return True
+                return frame.startswith(AUDIO_FRAME_PREFIX)
+
+            async def websocket_writer():
+                nonlocal queued_audio
+                try:
+                    while True:
+                        frame = await out_queue.get()
+                        # Drain whatever else is already queued before going
+                        # back to sleep, so a burst costs one wakeup.
+                        while frame is not None:
+                            if is_audio_frame(frame):
+                                queued_audio -= 1
+                            await websocket.send(frame)
+                            try:
+                                frame = out_queue.get_nowait()
+                            except asyncio.QueueEmpty:
+                                break
+                        if frame is None:
+                            break
+                except websockets.exceptions.ConnectionClosed:
+                    logger.info("Connection closed while writing to client.")
+
             async def gemini_to_client():
+                booking_confirmed = False
+                loop = asyncio.get_running_loop()
+                audio_buf = bytearray()
+                flush_handle = None
+
+                def flush_audio():
+                    """Emits the buffered PCM as one frame and resets the deadline."""
+                    nonlocal flush_handle, queued_audio, dropped_audio
+                    if flush_handle is not None:
+                        flush_handle.cancel()
+                        flush_handle = None
+                    if not audio_buf:
+                        return
+                    pcm_data = bytes(audio_buf)
+                    audio_buf.clear()
+                    if queued_audio >= MAX_QUEUED_AUDIO:
+                        # The client is seconds behind; stale audio is worth
+                        # less than bounded memory, so this chunk is dropped.
+                        dropped_audio += 1
+                        return
+                    queued_audio += 1
+                    if binary_audio:
+                        out_queue.put_nowait(b"\x01" + pcm_data)
+                    else:
+                        # base64 never needs JSON escaping, so splicing is safe.
+                        out_queue.put_nowait(AUDIO_FRAME_PREFIX + base64.b64encode(pcm_data).decode("ascii") + '"}')
+
+                async def process_function_call(fc):
+                    """Handles one function call and returns its FunctionResponse."""
+                    nonlocal booking_confirmed
+                    try:
+                        if fc.name == "get_fare_details":
+                            state.update(fc.args)
+                            # Validate date/time format before making the webhook call
+                            if state.startDate and not DATE_RE.match(state.startDate):
+                                logger.error(f"Invalid date format in state: {state.startDate}")
+                                return _function_response(id=fc.id, name=fc.name, response={"error": f"Invalid date format: {state.startDate}, expected DD-MM-YYYY"})
+                            if state.startTime and not TIME_RE.match(state.startTime):
+                                logger.error(f"Invalid time format in state: {state.startTime}")
+                                return _function_response(id=fc.id, name=fc.name, response={"error": f"Invalid time format: {state.startTime}, expected H:MM AM/PM"})
+
+                            n8n_payload = {**n8n_base, "state": state.to_dict()}
+                            n8n_response = await submit_n8n_payload(n8n_payload)
+                            state.fare = n8n_response.get("fare")
+                            if "state" in n8n_response:
+                                state.update(n8n_response["state"])
+                            return _function_response(id=fc.id, name=fc.name, response=n8n_response)
+
+                        elif fc.name == "book_ride":
+                            state.update(fc.args)
+                            n8n_payload = {**n8n_base, "state": state.to_dict()}
+                            n8n_response = await submit_n8n_payload(n8n_payload)
+                            if n8n_response.get("status") == "BOOKING_CONFIRMED":
+                                booking_confirmed = True
+                            return _function_response(id=fc.id, name=fc.name, response=n8n_response)
+
+                    except Exception as e:
+                        logger.error(f"Error processing function call '{fc.name}': {e}")
+                        return _function_response(id=fc.id, name=fc.name, response={"error": str(e)})
+
+                # Tool calls run as background tasks so the receive loop keeps
+                # delivering audio during the n8n round-trip; the set keeps
+                # strong references until each task finishes.
+                pending_tool_tasks = set()
+
+                async def dispatch_tool_calls(function_calls):
+                    try:
+                        results = await asyncio.gather(
+                            *(process_function_call(fc) for fc in function_calls)
+                        )
+                        function_responses = [r for r in results if r is not None]
+                        if function_responses:
+                            await session.send_tool_response(function_responses=function_responses)
+                    except Exception as e:
+                        logger.error(f"Error sending tool response: {e}")
+
+                transcript_bufs = {"transcription_chunk": [], "response_chunk": []}
+                transcript_handle = None
+
+                def flush_transcripts():
+                    """Emits buffered transcription deltas, one frame per direction."""
+                    nonlocal transcript_handle
+                    if transcript_handle is not None:
+                        transcript_handle.cancel()
+                        transcript_handle = None
+                    for key, buf in transcript_bufs.items():
+                        if buf:
+                            out_queue.put_nowait(orjson.dumps({
+                                "type": "chunk", key: "".join(buf), "session_id": session_id
+                            }).decode())
+                            buf.clear()
+
+                def buffer_transcript(key, text):
+                    nonlocal transcript_handle
+                    buf = transcript_bufs[key]
+                    buf.append(text)
+                    if sum(map(len, buf)) >= TRANSCRIPT_FLUSH_CHARS:
+                        flush_transcripts()
+                    elif transcript_handle is None:
+                        transcript_handle = loop.call_later(TRANSCRIPT_FLUSH_INTERVAL, flush_transcripts)
+
                 try:
-                    booking_confirmed = False
+                    # Hoist attribute lookups that are invariant across the
+                    # many-per-second message loop.
+                    call_later = loop.call_later
+                    # session.receive() yields one turn and then stops, so the
+                    # outer loop is what keeps a multi-turn conversation alive;
+                    # it cannot be flattened into a single async for.
                     while True:
                         async for gemini_message in session.receive():
-                            # Handle audio data
-                            if gemini_message.data is not None:
-                                pcm_data = base64.b64decode(gemini_message.data)
-                                audio_chunk_b64 = base64.b64encode(pcm_data).decode('utf-8')
-                                await websocket.send(json.dumps({
-                                    "type": "audio_chunk", "audio_chunk": audio_chunk_b64, "session_id": session_id
-                                }))
+                            # Handle audio data; chunks are buffered and sent
+                            # in coalesced frames by flush_audio.
+                            data = gemini_message.data
+                            if data is not None:
+                                audio_buf += data if isinstance(data, bytes) else binascii.a2b_base64(data)
+                                if len(audio_buf) >= AUDIO_FLUSH_BYTES:
+                                    flush_audio()
+                                elif flush_handle is None:
+                                    flush_handle = call_later(AUDIO_FLUSH_INTERVAL, flush_audio)
 
                             # Handle transcriptions
-                            if gemini_message.server_content:
-                                if gemini_message.server_content.input_transcription:
-                                    await websocket.send(json.dumps({
-                                        "type": "chunk", "transcription_chunk": gemini_message.server_content.input_transcription.text, "session_id": session_id
-                                    }))
-                                    logger.info(f"Transcription: {gemini_message.server_content.input_transcription.text}")
-                                if gemini_message.server_content.output_transcription:
-                                    await websocket.send(json.dumps({
-                                        "type": "chunk", "response_chunk": gemini_message.server_content.output_transcription.text, "session_id": session_id
-                                    }))
-                                    logger.info(f"Response: {gemini_message.server_content.output_transcription.text}")
-
-                            # Handle tool calls
-                            if gemini_message.tool_call:
-                                logger.info(f"Tool call received: {gemini_message.tool_call}")
-                                function_responses = []
-                                for fc in gemini_message.tool_call.function_calls:
-                                    try:
-                                        if fc.name == "get_fare_details":
-                                            state.update(fc.args)
-                                            # Validate date/time format before making the webhook call
-                                            try:
-                                                if state.get("startDate"): datetime.strptime(state["startDate"], "%d-%m-%Y")
-                                                if state.get("startTime"): datetime.strptime(state["startTime"], "%I:%M %p")
-                                            except ValueError as e:
-                                                logger.error(f"Invalid date/time format in state: {e}")
-                                                function_responses.append(types.FunctionResponse(id=fc.id, name=fc.name, response={"error": f"Invalid date/time format: {e}"}))
-                                                continue
-                                            
-                                            n8n_payload = {"session_id": session_id, "state": state, "headers": {"authorization": state.get("authorization_token", "")}}
-                                            n8n_response = await call_n8n_webhook(n8n_payload)
-                                            state["fare"] = n8n_response.get("fare")
-                                            if "state" in n8n_response:
-                                                state.update(n8n_response["state"])
-                                            function_responses.append(types.FunctionResponse(id=fc.id, name=fc.name, response=n8n_response))
-
-                                        elif fc.name == "book_ride":
-                                            state.update(fc.args)
-                                            n8n_payload = {"session_id": session_id, "state": state, "headers": {"authorization": state.get("authorization_token", "")}}
-                                            n8n_response = await call_n8n_webhook(n8n_payload)
-                                            if n8n_response.get("status") == "BOOKING_CONFIRMED":
-                                                booking_confirmed = True
-                                            function_responses.append(types.FunctionResponse(id=fc.id, name=fc.name, response=n8n_response))
-                                    
-                                    except Exception as e:
-                                        logger.error(f"Error processing function call '{fc.name}': {e}")
-                                        function_responses.append(types.FunctionResponse(id=fc.id, name=fc.name, response={"error": str(e)}))
-                                
-                                await session.send_tool_response(function_responses=function_responses)
-
-                            if gemini_message.server_content and gemini_message.server_content.turn_complete:
-                                await asyncio.sleep(0.5)
-                                await websocket.send(json.dumps({"type": "final", "session_id": session_id}))
+                            sc = gemini_message.server_content
+                            if sc is not None:
+                                it = sc.input_transcription
+                                if it:
+                                    buffer_transcript("transcription_chunk", it.text)
+                                    logger.debug("Transcription: %s", it.text)
+                                ot = sc.output_transcription
+                                if ot:
+                                    buffer_transcript("response_chunk", ot.text)
+                                    logger.debug("Response: %s", ot.text)
+
+                            # Handle tool calls; parallel calls within one
+                            # message are gathered, and the whole dispatch runs
+                            # off the receive loop so in-flight audio is not
+                            # stalled for the webhook RTT.
+                            tool_call = gemini_message.tool_call
+                            if tool_call is not None:
+                                logger.info("Tool call received: %s", tool_call)
+                                task = asyncio.create_task(
+                                    dispatch_tool_calls(tool_call.function_calls)
+                                )
+                                pending_tool_tasks.add(task)
+                                task.add_done_callback(pending_tool_tasks.discard)
+
+                            if sc is not None and sc.turn_complete:
+                                # Flushing synchronously enqueues all pending
+                                # frames ahead of "final", so no drain sleep is
+                                # needed — the writer preserves FIFO order.
+                                flush_audio()
+                                flush_transcripts()
+                                out_queue.put_nowait(FINAL_FRAME)
                                 logger.info("Gemini turn complete.")
                                 if booking_confirmed:
                                     logger.info("Booking confirmed, sending final confirmation to client.")
-                                    await websocket.send(json.dumps({"type": "confirm"}))
-                                    break # End the loop after confirmation
+                                    out_queue.put_nowait(CONFIRM_FRAME)
+                                    # return rather than break: break would only
+                                    # leave the per-turn iterator and the outer
+                                    # loop would re-enter receive() forever.
+                                    return
 
                 except websockets.exceptions.ConnectionClosed:
                     logger.info("Connection closed while streaming from Gemini.")
                 except Exception as e:
                     logger.error(f"Error in gemini_to_client task: {e}")
-                    await websocket.send(json.dumps({"error": str(e), "session_id": session_id}))
+                    out_queue.put_nowait(orjson.dumps({"error": str(e), "session_id": session_id}).decode())
+                finally:
+                    for task in pending_tool_tasks:
+                        task.cancel()
+                    flush_audio()
+                    flush_transcripts()
+                    if dropped_audio:
+                        logger.warning(f"Dropped {dropped_audio} audio frames for slow client in session {session_id}.")
+                    out_queue.put_nowait(None)
 
             async def client_to_gemini():
                 try:
                     async for message in websocket:
-                        data = json.loads(message)
+                        # Binary ingress: 1-byte tag + raw PCM16 @16k. No JSON
+                        # parse, no base64 decode — mirrors the opt-in binary
+                        # egress path.
+                        if isinstance(message, bytes):
+                            if message[:1] == b"\x01":
+                                await session.send_realtime_input(
+                                    audio=types.Blob(data=message[1:], mime_type="audio/pcm;rate=16000")
+                                )
+                            else:
+                                logger.warning("Unknown binary frame tag: %r", message[:1])
+                            continue
+                        data = orjson.loads(message)
                         user_input = data.get("text")
                         audio_input = data.get("audio")
                         
                         if user_input:
                             await session.send_client_content(turns={"role": "user", "parts": [{"text": user_input}]}, turn_complete=True)
-                            logger.info(f"Client sent text to Gemini: {user_input}")
+                            logger.debug("Client sent text to Gemini: %s", user_input)
                         elif audio_input:
-                            audio_bytes = base64.b64decode(audio_input)
+                            # Decode off the event loop so a large clip never
+                            # stalls the other sessions on this process.
+                            audio_bytes = await asyncio.to_thread(_decode_audio, audio_input)
+                            # Clients send raw PCM16; an optional "sample_rate"
+                            # field labels non-16k streams without a server-side
+                            # decode/resample step.
+                            sample_rate = data.get("sample_rate", 16000)
                             await session.send_realtime_input(
-                                audio=types.Blob(data=audio_bytes, mime_type="audio/pcm;rate=16000")
+                                audio=types.Blob(data=audio_bytes, mime_type=f"audio/pcm;rate={sample_rate}")
                             )
-                            logger.info(f"Client sent audio to Gemini: {audio_input}")
+                            logger.debug("Client sent audio to Gemini: %d bytes", len(audio_bytes))
                 except websockets.exceptions.ConnectionClosed:
                     logger.info("Client connection closed.")
                 except Exception as e:
                     logger.error(f"Error in client_to_gemini task: {e}")
-                    await websocket.send(json.dumps({"error": str(e), "session_id": session_id}))
+                    await websocket.send(orjson.dumps({"error": str(e), "session_id": session_id}).decode())
 
-            # Run both tasks concurrently and wait for them to complete
-            await asyncio.gather(gemini_to_client(), client_to_gemini())
+            # Run the pumps concurrently, cancelling in both directions: when
+            # the Gemini side finishes (e.g. after a confirmed booking) the
+            # client reader is cancelled, and when the client reader ends
+            # (client disconnected) the Gemini side is cancelled — otherwise
+            # it would sit in session.receive() holding the live connection
+            # and a semaphore slot until Gemini times the session out.
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(websocket_writer())
+                client_task = tg.create_task(client_to_gemini())
+                gemini_task = tg.create_task(gemini_to_client())
+                gemini_task.add_done_callback(lambda _: client_task.cancel())
+                client_task.add_done_callback(lambda _: gemini_task.cancel())
             logger.info(f"Session {session_id} ended.")
 
     except Exception as e:
         logger.error(f"Overall websocket error: {e}")
         try:
-            await websocket.send(json.dumps({"error": str(e), "session_id": session_id}))
+            await websocket.send(orjson.dumps({"error": str(e), "session_id": session_id}).decode())
         except websockets.exceptions.ConnectionClosed:
             pass # Client already disconnected
+    finally:
+        SESSION_SEM.release()
 
 async def main():
     """Starts the WebSocket server."""
+    # Python 3.12+: skip a scheduling round-trip for coroutines that can
+    # complete their first step synchronously.
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
     port = int(os.getenv("PORT", 8765))
-    async with websockets.serve(handle_websocket, "0.0.0.0", port):
-        logger.info(f"WebSocket server started on ws://0.0.0.0:{port}")
-        await asyncio.Future()  # Run forever
+    try:
+        # Compression is disabled: the payloads are base64 PCM audio and small
+        # JSON frames, so permessage-deflate costs CPU without shrinking much.
+        async with websockets.serve(
+            handle_websocket,
+            "0.0.0.0",
+            port,
+            compression=None,
+            max_size=4 * 1024 * 1024,
+            max_queue=64,
+            ping_interval=20,
+            ping_timeout=20,
+        ):
+            logger.info(f"WebSocket server started on ws://0.0.0.0:{port}")
+            await asyncio.Future()  # Run forever
+    finally:
+        await close_client()
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+        logger.info("Using uvloop event loop.")
+    except ImportError:
+        pass  # uvloop is unavailable on Windows; fall back to the default loop
     asyncio.run(main())
@@ -1,3 +1,12 @@
+import logging
+
+import httpx
+
+from config import get_client, PLACES_API_KEY
+
+logger = logging.getLogger(__name__)
+
+
 async def call_places_api(text_query: str):
     """Calls the Google Places API to find places."""
     headers = {
@@ -12,11 +21,11 @@ async def call_places_api(text_query: str):
     url = 'https://places.googleapis.com/v1/places:searchText'
 
     try:
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.post(url, json=data, headers=headers))
+        client = await get_client()
+        response = await client.post(url, json=data, headers=headers)
         response.raise_for_status()
         return response.json()
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error calling Places API: {e}")
         return {"error": f"Failed to connect to Places API: {str(e)}"}
 
@@ -34,18 +43,3 @@ search_places = {
         "required": ["textQuery"]
     }
 }
-
-search_places = {
-    "name": "search_places",
-    "description": "Searches for places like restaurants, cafes, or landmarks based on a text query.",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "textQuery": {
-                "type": "string",
-                "description": "The search query from the user, for example: 'italian restaurants in dubai' or 'cafes near dubai mall'."
-            }
-        },
-        "required": ["textQuery"]
-    }
-}
\ No newline at end of file